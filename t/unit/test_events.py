@@ -277,6 +277,30 @@ class test_ModelEvent:
         event = self.mock_event('foo.custom')
         event.connect_model(self.Model)
 
+    def test_connect_model__compiles_filter(self):
+        event = self.mock_event('foo.custom', fieldA__eq=30)
+        event.connect_model(self.Model)
+        assert event._filter_predicate._eval is not None
+
+    def test_connect_model__does_not_compile_filterargs(self):
+        nested = Q(fieldA__eq=30)
+        event = self.mock_event('foo.custom', nested, fieldB__now_eq=1)
+        event.connect_model(self.Model)
+        assert event._filter_predicate._eval is not None
+        assert nested._eval is None
+
+    def test_reduce__connected_filter(self, app):
+        event = ModelEvent('x.y', Q(a__eq=1), b__now_eq=1, app=app)
+        event.connect_model(self.Model)
+        instance = Mock(a=1, b=1)
+        instance._previous_version = Mock(b=0)
+        assert event.should_dispatch(instance)
+        e2 = pickle.loads(pickle.dumps(event))
+        assert e2.name == event.name
+        assert e2.should_dispatch(instance)
+        e2.connect_model(self.Model)
+        assert pickle.loads(pickle.dumps(e2)).should_dispatch(instance)
+
     def test_instance_data__defined(self, event):
         instance = self.Model()
         assert (event.instance_data(instance) is
@@ -1,10 +1,14 @@
 from __future__ import absolute_import, unicode_literals
 
+import operator
+import pickle
 import pytest
 
 from case import Mock, patch
 
-from thorn.utils.functional import Q, chunks, traverse_subscribers
+from thorn.utils.functional import (
+    Q, chunks, compile_transition, freeze_children, traverse_subscribers,
+)
 
 
 @pytest.mark.parametrize('max,input,expected', [
@@ -15,6 +19,37 @@ def test_chunks(max, input, expected):
     assert list(chunks(iter(input), max)) == expected
 
 
+@pytest.mark.parametrize('max', [0, -1])
+def test_chunks__invalid_size(max):
+    with pytest.raises(ValueError):
+        chunks(iter([1, 2, 3]), max)
+
+
+@pytest.mark.parametrize('max,input,expected', [
+    (2, range(10), [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]),
+    (2, range(9), [[0, 1], [2, 3], [4, 5], [6, 7], [8]]),
+    (3, list(range(4)), [[0, 1, 2], [3]]),
+    (3, [], []),
+    (0, [1], ValueError),
+    (-1, [], ValueError),
+])
+def test_chunks__without_batched(max, input, expected, monkeypatch):
+    monkeypatch.setattr('thorn.utils.functional.batched', None)
+    if expected is ValueError:
+        with pytest.raises(ValueError):
+            chunks(iter(input), max)
+        return
+    assert list(chunks(iter(input), max)) == expected
+
+
+def test_compile_transition():
+    now_in = compile_transition('{a} in {b}', '{a} not in {b}', 'now_in')
+    assert now_in.__name__ == 'now_in'
+    assert now_in('x', 'xyz', 'a')
+    assert not now_in('x', 'xyz', 'y')
+    assert not now_in('a', 'xyz', 'b')
+
+
 class test_Q:
 
     def test_missing_op(self):
@@ -29,6 +64,107 @@ class test_Q:
         with pytest.raises(AttributeError):
             Q(foo__eq=30)(object())
 
+    def test_prepare_statement(self):
+        assert Q().prepare_statement('foo__eq', 1) == (('foo',), 'eq')
+        assert Q().prepare_statement('foo__bar__baz__gt', 1) == (
+            ('foo', 'bar', 'baz'), 'gt',
+        )
+
+    def test_stack__shared(self):
+        assert Q(foo__eq=30).stack is Q(foo__eq=30).stack
+        assert Q(foo__eq=30).stack is not Q(foo__eq=31).stack
+        assert Q(foo__eq=1).stack is not Q(foo__eq=True).stack
+
+    def test_stack__not_shared(self):
+        assert Q(foo__in=[1, 2]).stack is not Q(foo__in=[1, 2]).stack
+        assert Q(foo__is=None).stack is not Q(foo__is=None).stack
+        assert Q(foo__is_not=None).stack is not Q(foo__is_not=None).stack
+        assert Q(foo__now_is=None).stack is not Q(foo__now_is=None).stack
+        assert (Q(foo__now_is_not=None).stack is not
+                Q(foo__now_is_not=None).stack)
+
+    def test_stack__identity_operators(self):
+        a, b = 10 ** 20, int(str(10 ** 20))
+        assert a == b and a is not b
+        x = Mock(foo=b)
+        x._previous_version = Mock(foo=None)
+        for opcode in ('is', 'now_is'):
+            q1, q2 = Q(**{'foo__' + opcode: a}), Q(**{'foo__' + opcode: b})
+            q1.inline = q2.inline = False
+            assert not q1(x)
+            assert q2(x)
+        assert Q(Q(foo__eq=1)).stack is not Q(Q(foo__eq=1)).stack
+
+    def test_stack__operators_replaced(self):
+        class XQ(Q):
+            inline = False
+
+        assert XQ(foo__eq=1)(Mock(foo=1))
+        XQ.operators = dict(Q.operators, eq=operator.ne)
+        assert not XQ(foo__eq=1)(Mock(foo=1))
+        assert Q(foo__eq=1)(Mock(foo=1))
+
+    def test_stack__cached_per_class(self):
+        class XQ(Q):
+            pass
+
+        assert XQ(foo__eq=30).stack is XQ(foo__eq=30).stack
+        assert XQ(foo__eq=30).stack is not Q(foo__eq=30).stack
+
+    def test_freeze_children(self):
+        assert freeze_children([('foo__eq', 1), ('bar__gt', 2)]) == (
+            ('foo__eq', int, 1), ('bar__gt', int, 2),
+        )
+        assert freeze_children([('foo__in', [1, 2])]) is None
+        assert freeze_children([Q(foo__eq=1)]) is None
+
+    @pytest.mark.parametrize('opcode,rhs,expected', [
+        ('eq', True, 'true'),
+        ('eq', False, 'not'),
+        ('ne', True, 'not'),
+        ('ne', False, 'true'),
+        ('eq', 1, 'eq'),
+        ('ne', 0, 'ne'),
+        ('gt', True, 'gt'),
+        ('now_eq', True, 'now_eq'),
+    ])
+    def test_prepare_opcode(self, opcode, rhs, expected):
+        assert Q().prepare_opcode(opcode, rhs) == expected
+
+    def test_slots(self):
+        class X(object):
+            __slots__ = ('foo', '_previous_version')
+
+        x = X()
+        x.foo, x._previous_version = 1, X()
+        x._previous_version.foo = 0
+        for inline in (True, False):
+            q = Q(foo__eq=1) & Q(foo__now_eq=1)
+            q.inline = inline
+            assert q(x)
+            assert q.match_many([x]) == [True]
+
+    def test_non_identifier_attributes(self):
+        x = Mock()
+        setattr(x, 'class', 1)
+        x._previous_version = Mock()
+        setattr(x._previous_version, 'class', 0)
+        assert Q(**{'class__eq': 1})(x)
+        assert Q(**{'class__now_eq': 1})(x)
+        assert not Q(**{'class__eq': 0})(x)
+
+    @pytest.mark.parametrize('inline', [True, False])
+    def test_non_normalized_attributes(self, inline):
+        x = Mock(fi=0)
+        setattr(x, '\ufb01', 1)
+        x._previous_version = Mock(fi=1)
+        setattr(x._previous_version, '\ufb01', 0)
+        q = Q(**{'\ufb01__eq': 1})
+        assert q.compile_to_source() is None
+        q.inline = inline
+        assert q(x)
+        assert Q(**{'\ufb01__now_eq': 1})(x)
+
     def test_eq(self):
         assert Q(foo__eq=30)(Mock(foo=30))
 
@@ -181,12 +317,287 @@ class test_Q:
         assert q3(x)
         assert not q4(x)
 
+    def test_negate__bound_on_first_call(self):
+        x = Mock(foo=1)
+        q = Q(foo__eq=1)
+        assert q(x)
+        assert not (~q)(x)
+        q2 = Q(foo__eq=1)
+        q2.negate()
+        assert not q2(x)
+
+    @pytest.mark.parametrize('inline', [True, False])
+    def test_negate__after_call(self, inline):
+        x = Mock(foo=1)
+        q = Q(foo__eq=1)
+        q.inline = inline
+        assert q(x)
+        q.negate()
+        assert not q(x)
+        assert q.match_many([x]) == [False]
+        q.negate()
+        assert q(x)
+
+    @pytest.mark.parametrize('inline', [True, False])
+    def test_add__after_call(self, inline):
+        x = Mock(foo=1, bar=2)
+        q = Q(foo__eq=2)
+        q.inline = inline
+        assert not q(x)
+        q.add(Q(bar__eq=2), Q.OR)
+        assert q.connector == Q.OR
+        assert q(x)
+        q.add(Q(bar__eq=3), Q.AND)
+        assert not q(x)
+
+    def test_custom_gate(self):
+        class XorQ(Q):
+            gates = dict(Q.gates, XOR=lambda it: sum(map(bool, it)) == 1)
+
+        x = Mock(foo=1, bar=2)
+        q = XorQ(foo__eq=1, bar__eq=2)
+        q.connector = 'XOR'
+        assert not q(x)
+        q = XorQ(foo__eq=1, bar__eq=3)
+        q.connector = 'XOR'
+        assert q(x)
+
+    @pytest.mark.parametrize('connector,negated,expected', [
+        (Q.AND, False, '_eval_and'),
+        (Q.AND, True, '_eval_and_not'),
+        (Q.OR, False, '_eval_or'),
+        (Q.OR, True, '_eval_or_not'),
+    ])
+    def test_evaluators(self, connector, negated, expected):
+        q = Q(foo__eq=1, bar__eq=2)
+        q.connector, q.negated, q.inline = connector, negated, False
+        assert q._eval is None
+        assert q(Mock(foo=1, bar=2)) is not negated
+        assert q._eval.__name__ == expected
+
+    def test_custom_branches(self):
+        class XQ(Q):
+            branches = {True: lambda r: not r, False: bool}
+
+        q = XQ(foo__eq=1)
+        assert q(Mock(foo=1))
+        assert not (~q)(Mock(foo=1))
+        assert q._eval.__name__ == '_eval_gate'
+
+    def test_or__short_circuits(self):
+        x = Mock(foo=1)
+        del x.bar
+        assert (Q(foo__eq=1) | Q(bar__eq=2))(x)
+        with pytest.raises(AttributeError):
+            (Q(foo__eq=2) | Q(bar__eq=2))(x)
+
+    def test_optable__subclass(self):
+        class XQ(Q):
+            operators = dict(Q.operators, now_mod=lambda a, b, _: not a % b)
+
+        assert XQ.get_optable()['now_mod'] == (XQ.operators['now_mod'], True)
+        assert XQ.get_optable()['eq'] == (Q.operators['eq'], False)
+        assert 'now_mod' not in Q.get_optable()
+
+        x = Mock(foo=4)
+        x._previous_version = Mock(foo=3)
+        assert XQ(foo__now_mod=2)(x)
+
+    def test_optable__operators_replaced(self):
+        class XQ(Q):
+            pass
+
+        assert XQ.get_optable() == Q.get_optable()
+        XQ.operators = dict(Q.operators, mod=lambda a, b: not a % b)
+        assert 'mod' in XQ.get_optable()
+        assert XQ(foo__mod=2)(Mock(foo=4))
+
+    def test_warmup(self):
+        q = Q(foo__eq=1, bar__eq=2)
+        assert q.warmup() is q
+        assert q._matcher is not None
+        assert q._eval is q._matcher
+
+    def test_warmup__nested(self):
+        # transition operators cannot be inlined, so uses the stack.
+        q = Q(Q(foo__now_eq=1), bar__eq=2) | ~Q(baz__eq=3)
+        assert q.warmup() is q
+        assert q._matcher is None
+        nested = [f for f in q.stack if isinstance(f, Q)]
+        assert nested
+        for f in nested:
+            assert f._eval is not None
+        x = Mock(foo=1, bar=2, baz=3)
+        x._previous_version = Mock(foo=0)
+        assert q(x)
+        x._previous_version = Mock(foo=1)
+        assert not q(x)
+
+    def test_warmup__not_nested(self):
+        nested = Q(foo__now_eq=1)
+        q = Q(nested, bar__eq=2)
+        q.warmup(nested=False)
+        assert q._eval is not None
+        assert nested._eval is None
+
+    def test_warmup__missing_op(self):
+        with pytest.raises(ValueError):
+            Q(foo=30).warmup()
+
+    @pytest.mark.parametrize('inline', [True, False])
+    def test_pickle(self, inline):
+        x = Mock(foo=1, bar=2)
+        x._previous_version = Mock(bar=1)
+        q = Q(Q(foo__eq=1), bar__now_eq=2) | ~Q(foo__in={3, 4})
+        q.inline = inline
+        assert q.warmup()(x)
+        q2 = pickle.loads(pickle.dumps(q))
+        assert q2._eval is None
+        assert 'stack' not in q2.__dict__
+        assert q2.inline is inline
+        assert q2(x)
+        assert q(x)
+
+    def test_compile_to_source(self):
+        assert Q(a__b__gt=3, c__eq='x').compile_to_source() == (
+            'bool((obj.a.b > v0) and (obj.c == v1))', [3, 'x'],
+        )
+        assert (~Q(a__eq=True)).compile_to_source() == (
+            'not ((obj.a))', [True],
+        )
+        assert (Q(a__in='xy') | ~Q(b__startswith='x')).compile_to_source() == (
+            'bool((obj.a in v0) or (not ((obj.b.startswith(v1)))))',
+            ['xy', 'x'],
+        )
+        assert Q().compile_to_source() == ('bool(True)', [])
+
+    def test_compile_to_source__not_supported(self):
+        assert Q(a__now_eq=1).compile_to_source() is None
+        assert Q(Q(a__now_eq=1), b__eq=2).compile_to_source() is None
+        assert Q(**{'a__class__eq': 1}).compile_to_source() is None
+
+        class XQ(Q):
+            operators = dict(Q.operators, eq=lambda a, b: a == b)
+
+        assert XQ(a__eq=1).compile_to_source() is None
+
+    def test_compile_to_source__not_inline(self):
+        q = Q(foo__eq=1)
+        q.inline = False
+        assert q.compile_to_source() is None
+
+    def test_compile_to_source__nested_not_inline(self):
+        nested = Q(foo__eq=1)
+        nested.inline = False
+        q = Q(nested, bar__eq=2)
+        assert q.compile_to_source() is None
+        assert q(Mock(foo=1, bar=2))
+        assert nested._eval is not None
+        assert nested._matcher is None
+
+    def test_compile_to_source__nested_custom_call(self):
+        class NQ(Q):
+            def __call__(self, obj):
+                obj.calls += 1
+                return super(NQ, self).__call__(obj)
+
+        q = Q(NQ(foo__eq=1), bar__eq=2)
+        assert q.compile_to_source() is None
+        x = Mock(foo=1, bar=2, calls=0)
+        assert q(x)
+        assert x.calls == 1
+
+    @pytest.mark.parametrize('hook', [
+        'compile', 'compile_node', 'compile_op',
+        '_compile_match', '_compile_transition',
+    ])
+    def test_compile_to_source__overridden_hooks(self, hook):
+        def _hook(self, *args, **kwargs):
+            return getattr(super(XQ, self), hook)(*args, **kwargs)
+
+        XQ = type('XQ', (Q,), {hook: _hook})
+        assert XQ(foo__eq=1).compile_to_source() is None
+        assert Q(XQ(foo__eq=1)).compile_to_source() is None
+        assert XQ(foo__eq=1)(Mock(foo=1))
+
+    def test_compile_to_source__custom_compile_op(self):
+        class MyQ(Q):
+            def compile_op(self, *args):
+                return lambda obj: True
+
+        assert MyQ(foo__eq=1)(Mock(foo=2))
+        assert MyQ(foo__eq=1).match_many([Mock(foo=2)]) == [True]
+
+    def test_compile_to_source__missing_op(self):
+        with pytest.raises(ValueError):
+            Q(foo=30).compile_to_source()
+
+    def test_compile_matcher__shares_code(self):
+        m1 = Q(foo__eq=1).compile_matcher()
+        m2 = Q(foo__eq=2).compile_matcher()
+        assert m1.__code__ is m2.__code__
+        assert m1(Mock(foo=1))
+        assert not m2(Mock(foo=1))
+
+    @pytest.mark.parametrize('q', [
+        Q(foo__eq=1, bar__ne=2),
+        Q(foo__eq=True) | Q(bar__eq=False),
+        ~(Q(foo__gte=1) & Q(bar__lt=3)),
+        Q(Q(foo__in={1, 2}), ~Q(bar__not_in=[2]), bar__is_not=None),
+        Q(title__startswith='a', title__endswith='c', title__contains='b'),
+    ])
+    def test_compile_matcher__same_as_stack(self, q):
+        objs = [
+            Mock(foo=foo, bar=bar, title=title)
+            for foo in (0, 1, 2) for bar in (-1, 0, 2)
+            for title in ('abc', 'xbc')
+        ]
+        matcher = q.compile_matcher()
+        assert matcher is not None
+        q.inline = False
+        assert [matcher(obj) for obj in objs] == [q(obj) for obj in objs]
+
+    def test_match_many(self):
+        objs = [Mock(foo=1), Mock(foo=2), Mock(foo=3)]
+        assert Q(foo__gte=2).match_many(objs) == [False, True, True]
+        assert (~Q(foo__gte=2)).match_many(objs) == [True, False, False]
+        assert Q(foo__eq=1).match_many([]) == []
+
+    def test_match_many__or(self):
+        objs = [Mock(foo=1, bar=1), Mock(foo=2, bar=2), Mock(foo=3, bar=1)]
+        q = Q(foo__eq=3) | Q(bar__eq=2)
+        assert q.match_many(objs) == [False, True, True]
+        assert (~q).match_many(iter(objs)) == [True, False, False]
+
+    def test_match_many__short_circuits(self):
+        x, y = Mock(foo=1), Mock(foo=2)
+        del x.bar
+        q = Q(foo__eq=2) & Q(bar__eq=2)
+        assert q.match_many([x, y]) == [False, False]
+        assert (Q(foo__eq=1) | Q(bar__eq=2)).match_many([x]) == [True]
+
+    def test_match_many__no_children(self):
+        assert Q().match_many([Mock()]) == [True]
+        q = Q()
+        q.connector = Q.OR
+        assert q.match_many([Mock()]) == [False]
+
+    def test_match_many__nested(self):
+        objs = [Mock(foo=Mock(bar=i, baz=i % 2)) for i in range(4)]
+        q = Q(Q(foo__bar__gt=0) & Q(foo__bar__lt=3), foo__baz__eq=1)
+        assert q.match_many(objs) == [q(obj) for obj in objs]
+
     def test_now_eq__no_previous_version(self):
         class X(object):
             foo = 1
         q = Q(foo__now_eq=1)
         assert q(X())
 
+    def test_now_eq__previous_version_is_None(self):
+        x = Mock(foo=1, _previous_version=None)
+        assert Q(foo__now_eq=1)(x)
+        assert not Q(foo__now_eq=2)(x)
+
     def test_now_eq(self):
         x1 = Mock(foo=Mock(bar=1, baz=2))
         x1._previous_version = Mock(foo=Mock(bar=0, baz=2))
@@ -325,6 +736,7 @@ class test_Q:
 
 class test_traverse_subscribers:
 
+    @patch.dict('thorn.utils.functional._SYMBOL_CACHE', clear=True)
     @patch('thorn.utils.functional.symbol_by_name')
     def test_symbol_string(self, symbol_by_name):
         symbol_by_name.return_value = 'http://e.com'
@@ -334,5 +746,22 @@ class test_traverse_subscribers:
         ]
         symbol_by_name.assert_called_once_with('some.where.symbol')
 
+    @patch.dict('thorn.utils.functional._SYMBOL_CACHE', clear=True)
+    @patch('thorn.utils.functional.symbol_by_name')
+    def test_symbol_string__cached(self, symbol_by_name):
+        symbol_by_name.return_value = 'http://e.com'
+        for _ in range(3):
+            assert list(traverse_subscribers(['!some.where.symbol'])) == [
+                symbol_by_name.return_value,
+            ]
+        symbol_by_name.assert_called_once_with('some.where.symbol')
+
+    def test_callables(self):
+        x = [lambda name: [name, (lambda name: name.upper())], 'b']
+        assert list(traverse_subscribers(x, 'a')) == ['b', 'a', 'A']
+
+    def test_single_node(self):
+        assert list(traverse_subscribers('http://e.com')) == ['http://e.com']
+
     def test_none_items(self):
         assert list(traverse_subscribers([None, [None], None])) == []
@@ -385,8 +385,17 @@ class ModelEvent(Event):
     def connect_model(self, model):
         # type: (Any) -> None
         self.models.add(model)
+        self._prepare_filter_predicate()
         self._connect_model_signal(model)
 
+    def _prepare_filter_predicate(self):
+        # type: () -> None
+        # compile the filter now, so that it's not compiled
+        # when the first instance is dispatched.  The Q objects embedded
+        # in it are also in _filterargs, so these are left alone.
+        if isinstance(self._filter_predicate, Q):
+            self._filter_predicate.warmup(nested=False)
+
     def _connect_model_signal(self, model):
         # type: (Any) -> None
         if self.signal_dispatcher:
@@ -1,14 +1,20 @@
 """Functional-style utilities."""
 from __future__ import absolute_import, unicode_literals
 
+import keyword
 import operator
+import unicodedata
 
 from collections import deque
-from collections.abc import Callable
-from functools import partial
-from itertools import islice
+from functools import lru_cache, partial
+from itertools import compress, islice
 from six import string_types
 
+try:
+    from itertools import batched
+except ImportError:  # pragma: no cover
+    batched = None  # Python < 3.12
+
 from celery.utils import cached_property
 from celery.utils.functional import is_list, maybe_list
 from celery.utils.imports import symbol_by_name
@@ -24,6 +30,18 @@ E_FILTER_FIELD_MISSING_OP = (
     "filter field argument {0!r} not allowed: did you mean '{0}__eq'?"
 )
 
+E_CHUNK_SIZE = 'chunk size must be at least one, not {0!r}'
+
+#: Max number of entries to keep in the caches of compiled Q nodes.
+#: Note that every Q class keeps its own cache of compiled children,
+#: and the cached nodes keep the values compared with alive
+#: (e.g. model instances used in filters).
+Q_CACHE_MAXSIZE = 4096
+
+#: Suffix of filter fields that should never be cached, as these
+#: compare by identity and the cache looks up values by equality.
+Q_UNCACHEABLE_SUFFIXES = ('__is', '__is_not', '__now_is', '__now_is_not')
+
 
 def not_contains(a, b):
     """Operator for ``b not in a``.
@@ -33,6 +51,38 @@ def not_contains(a, b):
     return b not in a
 
 
+def contained_in(a, b):
+    """Operator for ``a in b``.
+
+    ``contained_in(a, b) -> a in b``
+    """
+    return a in b
+
+
+def not_contained_in(a, b):
+    """Operator for ``a not in b``.
+
+    ``not_contained_in(a, b) -> a not in b``
+    """
+    return a not in b
+
+
+def is_true(a, _):
+    """Operator for ``bool(a)``, ignoring the second argument.
+
+    ``is_true(a, b) -> bool(a)``
+    """
+    return bool(a)
+
+
+def is_false(a, _):
+    """Operator for ``not a``, ignoring the second argument.
+
+    ``is_false(a, b) -> not a``
+    """
+    return not a
+
+
 def startswith(a, b):
     """Function calling obj.startsiwth.
 
@@ -70,16 +120,57 @@ def reverse_arguments(n):
     return _inner
 
 
+def attrgetter_path(path):
+    """Return function getting the attribute at ``path`` from an object.
+
+    ``attrgetter_path(('a', 'b', 'c'))(obj) -> obj.a.b.c``
+    """
+    return operator.attrgetter('.'.join(path))
+
+
+#: Cache of symbols resolved by :func:`traverse_subscribers`.
+_SYMBOL_CACHE = {}
+
+
+def resolve_symbol(name):
+    """Return the object imported by ``name`` (cached).
+
+    See Also:
+        :func:`celery.utils.imports.symbol_by_name`.
+    """
+    try:
+        return _SYMBOL_CACHE[name]
+    except KeyError:
+        symbol = _SYMBOL_CACHE[name] = symbol_by_name(name)
+        return symbol
+
+
+def build_optable(operators):
+    """Build opcode table from mapping of opcode to operator function.
+
+    Returns:
+        Dict: mapping opcode to ``(operator, is_transition)`` tuple,
+            where ``is_transition`` is true for the ``now_*`` operators.
+    """
+    return {
+        opcode: (op, opcode.startswith('now_'))
+        for opcode, op in operators.items()
+    }
+
+
 def traverse_subscribers(it, *args, **kwargs):
-    stream = deque([it])
+    # only the root needs to be wrapped in a list: nested nodes are
+    # only added to the stream if they already are lists.
+    stream = deque([maybe_list(it)])
+    popleft, append = stream.popleft, stream.append
     while stream:
-        for node in maybe_list(stream.popleft()):
+        for node in popleft():
             if isinstance(node, string_types) and node.startswith('!'):
-                node = symbol_by_name(node[1:])
-            if isinstance(node, Callable):
+                node = resolve_symbol(node[1:])
+            if callable(node):
                 node = node(*args, **kwargs)
             if is_list(node):
-                stream.append(node)
+                append(node)
             elif node:
                 yield node
 
@@ -102,6 +193,142 @@ def wrap_transition(op, did_change):
     return compare
 
 
+def exec_function(source, name, filename):
+    """Execute Python source code and return function ``name`` it defines."""
+    namespace = {}
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace[name]
+
+
+TRANSITION_TEMPLATE = """\
+def {name}(new_value, needle, old_value):
+    return ({did_change}) and ({op})
+"""
+
+
+def compile_transition(op, did_change, name='compare'):
+    """Compile transition operator from expression templates.
+
+    Works like :func:`wrap_transition`, but the expressions are inlined
+    in the generated function so that matching is a single function call.
+
+    The templates are Python expressions, where ``{a}`` is replaced
+    by the value (new or old) and ``{b}`` by the value compared with.
+
+    Example:
+        >>> now_eq = compile_transition('{a} == {b}', '{a} != {b}')
+        >>> now_eq(new_value=1, needle=1, old_value=0)
+        True
+    """
+    source = TRANSITION_TEMPLATE.format(
+        name=name,
+        op=op.format(a='new_value', b='needle'),
+        did_change=did_change.format(a='old_value', b='needle'),
+    )
+    return exec_function(source, name, '<transition {0}>'.format(name))
+
+
+#: Python expression templates for operators that can be inlined
+#: by :meth:`Q.compile_to_source`, keyed by operator function.
+#: ``{a}`` is replaced by the attribute, ``{b}`` by the value compared with.
+OPERATOR_SOURCE = {
+    operator.eq: '{a} == {b}',
+    operator.ne: '{a} != {b}',
+    operator.gt: '{a} > {b}',
+    operator.lt: '{a} < {b}',
+    operator.ge: '{a} >= {b}',
+    operator.le: '{a} <= {b}',
+    contained_in: '{a} in {b}',
+    not_contained_in: '{a} not in {b}',
+    operator.is_: '{a} is {b}',
+    operator.is_not: '{a} is not {b}',
+    operator.contains: '{b} in {a}',
+    is_false: 'not {a}',
+    is_true: '{a}',
+    startswith: '{a}.startswith({b})',
+    endswith: '{a}.endswith({b})',
+}
+
+#: Boolean operator and value of empty node, by gate.
+GATE_SOURCE = {
+    all: (' and ', 'True'),
+    any: (' or ', 'False'),
+}
+
+MATCHER_TEMPLATE = """\
+def matcher({args}):
+    def match(obj):
+        return {source}
+    return match
+"""
+
+
+def is_identifier(name):
+    """Return true if ``name`` can be used as attribute in Python source.
+
+    Note:
+        Names are NFKC normalized when compiled, so names that are not
+        normalized would refer to a different attribute in the source.
+    """
+    return (
+        name.isidentifier() and
+        not keyword.iskeyword(name) and
+        unicodedata.normalize('NFKC', name) == name
+    )
+
+
+@lru_cache(maxsize=Q_CACHE_MAXSIZE)
+def compile_matcher_source(source, nargs):
+    """Compile matcher from source generated by :meth:`Q.compile_to_source`.
+
+    Returns:
+        Callable: taking the ``nargs`` values referenced by the
+            source (``v0, v1, ...``), and returning the match function.
+    """
+    code = MATCHER_TEMPLATE.format(
+        args=', '.join('v{0}'.format(i) for i in range(nargs)),
+        source=source,
+    )
+    return exec_function(code, 'matcher', '<Q {0}>'.format(source))
+
+
+MATCH_TEMPLATE = """\
+def match_factory(op, rhs):
+    def match(obj):
+        return op({value}, rhs)
+    return match
+"""
+
+TRANSITION_MATCH_TEMPLATE = """\
+def match_factory(op, rhs):
+    def match(obj):
+        prev = getattr(obj, '_previous_version', None)
+        return op({value}, rhs, None if prev is None else {previous})
+    return match
+"""
+
+
+@lru_cache(maxsize=Q_CACHE_MAXSIZE)
+def compile_path_match(path, transition=False):
+    """Compile match function factory for attribute ``path``.
+
+    The attribute lookup is compiled as regular attribute access
+    (``obj.a.b``), so it benefits from the interpreter caching the
+    attribute lookup per type (e.g. for ``__slots__`` members).
+
+    Returns:
+        Callable: taking ``(op, rhs)`` and returning the match function.
+    """
+    template = TRANSITION_MATCH_TEMPLATE if transition else MATCH_TEMPLATE
+    code = template.format(
+        value='.'.join(('obj',) + path),
+        previous='.'.join(('prev',) + path),
+    )
+    return exec_function(
+        code, 'match_factory', '<Q {0}>'.format('__'.join(path)),
+    )
+
+
 def chunks(it, n):
     """Split an iterator into chunks with `n` elements each.
 
@@ -115,9 +342,56 @@ def chunks(it, n):
         >>> x = chunks(iter([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]), 3)
         >>> list(x)
         [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9, 10]]
+
+    Raises:
+        ValueError: if ``n`` is less than one.
+    """
+    if n < 1:
+        raise ValueError(E_CHUNK_SIZE.format(n))
+    if batched is not None:
+        return map(list, batched(it, n))
+    return _chunks(iter(it), n)
+
+
+def _chunks(it, n):
+    chunk = list(islice(it, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, n))
+
+
+def freeze_children(children):
+    """Return hashable version of Q children, to be used as a cache key.
+
+    Returns:
+        Tuple: of ``(lhs, type(rhs), rhs)`` for every child, or
+            :const:`None` if the children cannot be cached (e.g. when
+            embedding other Q objects, or the values are not hashable).
     """
-    for first in it:
-        yield [first] + list(islice(it, n - 1))
+    frozen = []
+    for child in children:
+        if not isinstance(child, tuple):
+            return None  # embedded Q object
+        lhs, rhs = child
+        if lhs.endswith(Q_UNCACHEABLE_SUFFIXES):
+            return None
+        # type is part of the key, otherwise Q(x__eq=1) and
+        # Q(x__eq=True) would share the same cache entry.
+        frozen.append((lhs, type(rhs), rhs))
+    frozen = tuple(frozen)
+    try:
+        hash(frozen)
+    except TypeError:
+        return None
+    return frozen
+
+
+def _compile_children(cls, frozen_children):
+    # compiling nodes only depends on the class attributes, so we can
+    # use an uninitialized instance (__init__ may take arguments).
+    return tuple(cls.__new__(cls).compile(
+        [(lhs, rhs) for lhs, _, rhs in frozen_children]
+    ))
 
 
 class Q(_Q_):
@@ -174,47 +448,330 @@ class Q(_Q_):
     #: Operators may return any true-ish or false-y value.
     operators = {
         'eq': operator.eq,
-        'now_eq': wrap_transition(operator.eq, operator.ne),
+        'now_eq': compile_transition('{a} == {b}', '{a} != {b}', 'now_eq'),
         'ne': operator.ne,
-        'now_ne': wrap_transition(operator.ne, operator.ne),
+        'now_ne': compile_transition('{a} != {b}', '{a} != {b}', 'now_ne'),
         'gt': operator.gt,
-        'now_gt': wrap_transition(operator.gt, operator.lt),
+        'now_gt': compile_transition('{a} > {b}', '{a} < {b}', 'now_gt'),
         'lt': operator.lt,
-        'now_lt': wrap_transition(operator.lt, operator.gt),
+        'now_lt': compile_transition('{a} < {b}', '{a} > {b}', 'now_lt'),
         'gte': operator.ge,
-        'now_gte': wrap_transition(operator.ge, operator.le),
+        'now_gte': compile_transition('{a} >= {b}', '{a} <= {b}', 'now_gte'),
         'lte': operator.le,
-        'now_lte': wrap_transition(operator.le, operator.ge),
-        'in': reverse_arguments(2)(operator.contains),
-        'now_in': wrap_transition(
-            reverse_arguments(2)(operator.contains),
-            reverse_arguments(2)(not_contains),
+        'now_lte': compile_transition('{a} <= {b}', '{a} >= {b}', 'now_lte'),
+        'in': contained_in,
+        'now_in': compile_transition(
+            '{a} in {b}', '{a} not in {b}', 'now_in',
         ),
-        'not_in': reverse_arguments(2)(not_contains),
-        'now_not_in': wrap_transition(
-            reverse_arguments(2)(not_contains),
-            reverse_arguments(2)(operator.contains),
+        'not_in': not_contained_in,
+        'now_not_in': compile_transition(
+            '{a} not in {b}', '{a} in {b}', 'now_not_in',
         ),
         'is': operator.is_,
-        'now_is': wrap_transition(operator.is_, operator.is_not),
+        'now_is': compile_transition('{a} is {b}', '{a} is not {b}', 'now_is'),
         'is_not': operator.is_not,
-        'now_is_not': wrap_transition(operator.is_not, lambda a, _: a is None),
+        'now_is_not': compile_transition(
+            '{a} is not {b}', '{a} is None', 'now_is_not',
+        ),
         'contains': operator.contains,
-        'now_contains': wrap_transition(
-            operator.contains, negate(operator.contains),
+        'now_contains': compile_transition(
+            '{b} in {a}', '{b} not in {a}', 'now_contains',
         ),
-        'not': lambda x, _: operator.not_(x),
-        'true': lambda x, _: operator.truth(x),
+        'not': is_false,
+        'true': is_true,
         'startswith': startswith,
-        'now_startswith': wrap_transition(startswith, negate(startswith)),
+        'now_startswith': compile_transition(
+            '{a}.startswith({b})', 'not {a}.startswith({b})', 'now_startswith',
+        ),
         'endswith': endswith,
-        'now_endswith': wrap_transition(endswith, negate(endswith)),
+        'now_endswith': compile_transition(
+            '{a}.endswith({b})', 'not {a}.endswith({b})', 'now_endswith',
+        ),
     }
 
+    #: The branch, gate and evaluator of this node, bound on first call.
+    _branch = _gate = _eval = _matcher = None
+
+    #: Compile the node into a single function when possible,
+    #: see :meth:`compile_to_source`.
+    inline = True
+
+    #: Methods not called by the compiled source of a node: nodes of
+    #: subclasses overriding any of these are never inlined.
+    compile_hooks = (
+        '__call__', 'compile', 'compile_node', 'compile_op',
+        '_compile_match', '_compile_transition',
+    )
+
+    #: Opcodes replaced when the value compared with is :const:`True`.
+    #: E.g. ``x__eq=True`` matches any true-ish value.
+    true_opcodes = {'eq': 'true', 'ne': 'not'}
+
+    #: Opcodes replaced when the value compared with is :const:`False`.
+    #: E.g. ``x__eq=False`` matches any false-y value.
+    false_opcodes = {'eq': 'not', 'ne': 'true'}
+
+    @classmethod
+    def get_optable(cls):
+        """Return mapping of opcode to ``(operator, is_transition)``.
+
+        The table is built from :attr:`operators` on first use, for
+        every class, and built again if :attr:`operators` is replaced.
+        """
+        return cls._get_class_cache()[1]
+
+    @classmethod
+    def _get_class_cache(cls):
+        # (operators, optable, compile_children) for this class,
+        # where the compiled children are cached by frozen children.
+        # Everything is dropped when the operators are replaced.
+        cached = cls.__dict__.get('_class_cache')
+        if cached is None or cached[0] is not cls.operators:
+            cached = cls._class_cache = (
+                cls.operators,
+                build_optable(cls.operators),
+                lru_cache(maxsize=Q_CACHE_MAXSIZE)(
+                    partial(_compile_children, cls),
+                ),
+            )
+        return cached
+
     def __call__(self, obj):
         # NOT?( AND|OR(...) )
-        return self.branches[self.negated](
-            self.gate(f(obj) for f in self.stack)
+        if self._eval is None:
+            self._bind()
+        return self._eval(obj)
+
+    def warmup(self, nested=True):
+        """Compile this node, and the nodes below it, ahead of time.
+
+        Nodes are otherwise compiled when first called,
+        adding latency to the first object matched.
+
+        Arguments:
+            nested (bool): Also compile the Q nodes embedded in this
+                node, when these are not inlined in its matcher.
+                Enabled by default.
+
+        Note:
+            The compiled node is cached: :meth:`negate` and :meth:`add`
+            will reset it, but changing the attributes of the node
+            (or of the nodes below it) directly has no effect.
+
+        Returns:
+            Q: this node, for chaining.
+        """
+        if self._eval is None:
+            self._bind()
+        if nested and self._matcher is None:
+            for f in self.stack:
+                if isinstance(f, Q):
+                    f.warmup()
+        return self
+
+    def match_many(self, objs):
+        """Match multiple objects.
+
+        Faster than calling the node once for every object, as the
+        predicates are applied one at a time to the whole batch.
+
+        Returns:
+            List[bool]: of match results, in the same order as ``objs``.
+        """
+        if self._eval is None:
+            self._bind()
+        if self._matcher is not None:
+            return list(map(self._matcher, objs))
+        if self._gate is all:
+            # objects matching every predicate are the ones matching.
+            survivors_match = True
+        elif self._gate is any:
+            # objects matching no predicate are the ones not matching.
+            survivors_match = False
+        else:
+            return list(map(self._eval, objs))
+        objs = list(objs)
+        survivors = self._eval_columns(objs, keep_true=survivors_match)
+        results = [self._branch(not survivors_match)] * len(objs)
+        survivor_result = self._branch(survivors_match)
+        for i in survivors:
+            results[i] = survivor_result
+        return results
+
+    def _eval_columns(self, objs, keep_true=True):
+        # Apply every predicate to the objects still undecided,
+        # keeping only those where the result is ``keep_true``.
+        # Objects are dropped as soon as the result is known, so each
+        # predicate is called for the same objects as in __call__.
+        index, pending = range(len(objs)), objs
+        for f in self.stack:
+            if not pending:
+                break
+            selectors = map(f, pending)
+            if not keep_true:
+                selectors = map(operator.not_, selectors)
+            selectors = list(selectors)
+            index = list(compress(index, selectors))
+            pending = list(compress(pending, selectors))
+        return index
+
+    def negate(self):
+        super(Q, self).negate()
+        self._unbind()
+
+    def add(self, *args, **kwargs):
+        # may change both the children and the connector.
+        try:
+            return super(Q, self).add(*args, **kwargs)
+        finally:
+            self.__dict__.pop('stack', None)
+            self._unbind()
+
+    def __getstate__(self):
+        # compiled functions cannot be pickled,
+        # the node is compiled again when first called after unpickling.
+        state = self.__dict__.copy()
+        for attr in ('stack',) + self._bound_attrs:
+            state.pop(attr, None)
+        return state
+
+    #: Attributes bound on first call.
+    _bound_attrs = ('_branch', '_gate', '_eval', '_matcher')
+
+    def _unbind(self):
+        # forget the bound state, so that it's bound again on next call.
+        for attr in self._bound_attrs:
+            self.__dict__.pop(attr, None)
+
+    def _bind(self):
+        # negated/connector can still change after the node is created
+        # (e.g. ``~q`` negates a copy), so we only bind them on first call.
+        self._branch = self.branches[self.negated]
+        self._gate = self.gates[self.connector]
+        if self.inline:
+            self._matcher = self.compile_matcher()
+            if self._matcher is not None:
+                self._eval = self._matcher
+                return
+        # the default gates are evaluated using a short-circuiting loop,
+        # avoiding to create a generator for every object matched.
+        self._eval = getattr(self, self.evaluators.get(
+            (self._gate, self._branch), '_eval_gate',
+        ))
+
+    #: Evaluators specialized for the default gates and branches,
+    #: by ``(gate, branch)``.
+    evaluators = {
+        (all, operator.truth): '_eval_and',
+        (all, operator.not_): '_eval_and_not',
+        (any, operator.truth): '_eval_or',
+        (any, operator.not_): '_eval_or_not',
+    }
+
+    def _eval_and(self, obj):
+        for f in self.stack:
+            if not f(obj):
+                return False
+        return True
+
+    def _eval_and_not(self, obj):
+        for f in self.stack:
+            if not f(obj):
+                return True
+        return False
+
+    def _eval_or(self, obj):
+        for f in self.stack:
+            if f(obj):
+                return True
+        return False
+
+    def _eval_or_not(self, obj):
+        for f in self.stack:
+            if f(obj):
+                return False
+        return True
+
+    def _eval_gate(self, obj):
+        return self._branch(self._gate(f(obj) for f in self.stack))
+
+    def compile_matcher(self):
+        """Compile this node into a single function matching objects.
+
+        Returns:
+            Callable: taking the object to match, or :const:`None`
+                if the node cannot be compiled (see
+                :meth:`compile_to_source`).
+        """
+        compiled = self.compile_to_source()
+        if compiled is not None:
+            source, values = compiled
+            return compile_matcher_source(source, len(values))(*values)
+
+    def compile_to_source(self):
+        """Compile this node, and the nodes below it, into Python source.
+
+        Example:
+            >>> Q(a__b__gt=3, c__eq='x').compile_to_source()
+            ('bool((obj.a.b > v0) and (obj.c == v1))', [3, 'x'])
+
+        Returns:
+            Tuple[str, List]: of an expression matching ``obj``, and
+                the values referred to as ``v0, v1, ...``; or
+                :const:`None` if the node cannot be expressed as source
+                (e.g. when using transition operators).
+        """
+        values = []
+        source = self._node_to_source(values)
+        if source is not None:
+            return (
+                source if self.negated else 'bool({0})'.format(source),
+                values,
+            )
+
+    def _node_to_source(self, values):
+        if not self.inline or self._overrides_compile_hooks():
+            return None
+        try:
+            sep, empty = GATE_SOURCE[self.gates[self.connector]]
+        except KeyError:
+            return None  # custom gate
+        if self.branches[self.negated] is not (
+                operator.not_ if self.negated else operator.truth):
+            return None  # custom branch
+        expressions = []
+        for child in self.children:
+            if isinstance(child, _Q_):
+                # converts Django Q objects in-place, like compile_node.
+                if not isinstance(child, type(self)):
+                    child.__class__ = type(self)
+                expression = child._node_to_source(values)
+            else:
+                expression = self._field_to_source(child, values)
+            if expression is None:
+                return None
+            expressions.append('({0})'.format(expression))
+        source = sep.join(expressions) or empty
+        return 'not ({0})'.format(source) if self.negated else source
+
+    @classmethod
+    def _overrides_compile_hooks(cls):
+        return any(
+            getattr(cls, name) is not getattr(Q, name)
+            for name in cls.compile_hooks
+        )
+
+    def _field_to_source(self, field, values):
+        lhs, rhs = field
+        path, opcode = self.prepare_statement(lhs, rhs)
+        op, is_transition = self.get_optable()[opcode]
+        template = None if is_transition else OPERATOR_SOURCE.get(op)
+        if template is None or not all(map(is_identifier, path)):
+            return None
+        values.append(rhs)
+        return template.format(
+            a='.'.join(('obj',) + path),
+            b='v{0}'.format(len(values) - 1),
         )
 
     def compile(self, fields):
@@ -249,32 +806,65 @@ class Q(_Q_):
         lhs, _, opcode = lhs.rpartition('__')
         if not opcode or opcode not in self.operators:
             raise ValueError(E_FILTER_FIELD_MISSING_OP.format(lhs))
-        return lhs.replace('__', '.'), self.prepare_opcode(opcode, rhs)
+        # the attribute path is split once here, so that the compiled
+        # node never has to parse it again.
+        return tuple(lhs.split('__')), self.prepare_opcode(opcode, rhs)
 
     def prepare_opcode(self, O, rhs):
         # eq=True and friends are special, as they should match any
         # true-ish value (__bool__), not check for equality.
-        if (O == 'eq' and rhs is True) or O == 'ne' and rhs is False:
-            return 'true'
-        elif (O == 'eq' and rhs is False) or O == 'ne' and rhs is True:
-            return 'not'
+        if rhs is True:
+            return self.true_opcodes.get(O, O)
+        elif rhs is False:
+            return self.false_opcodes.get(O, O)
         return O
 
-    def compile_op(self, lhs, rhs, opcode):
-        return self._compile_op(
-            self.apply_trans_op if 'now' in opcode else self.apply_op,
-            lhs, rhs, opcode,
-        )
+    def compile_op(self, path, rhs, opcode):
+        op, is_transition = self.get_optable()[opcode]
+        if is_transition:
+            return self._compile_transition(path, rhs, op)
+        return self._compile_match(path, rhs, op)
 
-    def _compile_op(self, apply, lhs, rhs, opcode, *args):
+    def _compile_op(self, apply, path, rhs, opcode, *args):
         return partial(
-            apply,
-            operator.attrgetter(lhs), self.operators[opcode], rhs, *args
+            apply, attrgetter_path(path), self.operators[opcode], rhs, *args
         )
 
+    def _compile_match(self, path, rhs, op):
+        # Regular operators are compiled into a closure performing
+        # the attribute lookup inline, which saves the overhead of
+        # calling ``apply_op`` via :class:`~functools.partial`.
+        if all(map(is_identifier, path)):
+            return compile_path_match(path)(op, rhs)
+        elif len(path) == 1:
+            attr, = path
+
+            def match(obj):
+                return op(getattr(obj, attr), rhs)
+        else:
+            getter = attrgetter_path(path)
+
+            def match(obj):
+                return op(getter(obj), rhs)
+        return match
+
+    def _compile_transition(self, path, rhs, op):
+        # transition op (e.g. now_eq) only matches if the
+        # value differs from the previous version.
+        if all(map(is_identifier, path)):
+            return compile_path_match(path, transition=True)(op, rhs)
+        getter = attrgetter_path(path)
+
+        def match(obj):
+            prev = getattr(obj, '_previous_version', None)
+            return op(
+                getter(obj), rhs, None if prev is None else getter(prev),
+            )
+        return match
+
     def apply_op(self, getter, op, rhs, obj, *args):
-        # compiled nodes end up being partial versions of this method,
-        # with the getter, op and rhs arguments already set.
+        # compiled nodes inline this, but it's still used by the
+        # partial functions created by _compile_op.
         return op(getter(obj), rhs, *args)
 
     def apply_trans_op(self, getter, op, rhs, obj):
@@ -285,12 +875,8 @@ class Q(_Q_):
         )
 
     def _get_from_prev_version(self, getter, obj):
-        try:
-            prev = obj._previous_version
-        except AttributeError:
-            pass
-        else:
-            return getter(prev)
+        prev = getattr(obj, '_previous_version', None)
+        return None if prev is None else getter(prev)
 
     @property
     def gate(self):
@@ -298,5 +884,9 @@ class Q(_Q_):
 
     @cached_property
     def stack(self):
-        # the stack is cached on first call.
-        return self.compile(self.children)
+        # the stack is cached on first call, and Q objects with the same
+        # children will also share the compiled nodes whenever possible.
+        frozen_children = freeze_children(self.children)
+        if frozen_children is None:
+            return self.compile(self.children)
+        return self._get_class_cache()[2](frozen_children)